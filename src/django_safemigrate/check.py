@@ -4,10 +4,22 @@ Ensure migrations are using django_safemigrate.
 This is fairly rudimentary and won't work if the class doesn't
 explicitly inherit from ``Migration``.
 """
+import json
+import mmap
+import os
 import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
-MIGRATION_PATTERN = re.compile(r"class\s+(?P<MigrationClass>\w+)\s?\(.*Migration\):")
+# A single alternation finds the migration class declaration and any
+# safe definition in one pass over the file. The pre-enum-call style
+# (``safe = Safe.always``) must come before the bare ``safe = Safe.``
+# branch so it wins when both could match.
+MIGRATION_PATTERN = re.compile(
+    rb"class\s+(?P<MigrationClass>\w+)\s?\(.*Migration\):"
+    rb"|safe = Safe\.(?P<deprecated>always|before_deploy|after_deploy)\r?\n"
+    rb"|(?P<safe>safe = Safe\.)"
+)
 
 MISSING_SAFE_MESSAGE = (
     "{file_path}: {migration_class} is missing the 'safe' attribute.\n"
@@ -26,45 +38,112 @@ FAILURE_MESSAGE = (
     "    safe = Safe.after_deploy()\n"
     "\n"
 )
-ENUM_DEFINITIONS = [
-    "safe = Safe.always\n",
-    "safe = Safe.after_deploy\n",
-    "safe = Safe.before_deploy\n",
-]
+# Below this many files a process pool costs more than it saves.
+PARALLEL_THRESHOLD = 50
+
+# Stat signatures of migrations that already passed, so repeated hook
+# runs only scan files that have changed.
+CACHE_PATH = ".safemigrate-cache"
+
+
+def load_cache():
+    try:
+        with open(CACHE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def store_cache(cache):
+    try:
+        with open(CACHE_PATH, "w") as f:
+            json.dump(cache, f)
+    except OSError:  # pragma: no cover
+        pass
+
+
+def file_signature(file_path):
+    # mtime and size identify an unchanged file without reading it,
+    # so cached files cost one stat call instead of a full scan.
+    stat = os.stat(file_path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def scan_migration(file_path):
+    """Scan a single migration file and return its messages."""
+    messages = []
+    with open(file_path, "rb") as f:
+        try:
+            content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # An empty file can't be mapped.
+            return messages
+        with content:
+            # A file without the literal "Migration" can't declare a
+            # migration class; skip the pattern pass entirely.
+            if content.find(b"Migration") == -1:
+                return messages
+            migration_class = None
+            has_safe = False
+            deprecated = []
+            for match in MIGRATION_PATTERN.finditer(content):
+                if match["MigrationClass"] is not None:
+                    if migration_class is None:
+                        migration_class = match["MigrationClass"].decode()
+                elif match["deprecated"] is not None:
+                    has_safe = True
+                    deprecated.append(match["deprecated"].decode())
+                else:
+                    has_safe = True
+    if migration_class is None:
+        return messages
+    if not has_safe:
+        messages.append(
+            MISSING_SAFE_MESSAGE.format(
+                file_path=file_path, migration_class=migration_class
+            )
+        )
+    # Report each deprecated definition once per file, in the order
+    # first encountered.
+    for name in dict.fromkeys(deprecated):
+        definition = f"safe = Safe.{name}"
+        messages.append(
+            UPGRADE_SAFE_DEFINITION_MESSAGE.format(
+                file_path=file_path,
+                migration_class=migration_class,
+                definition=definition,
+                corrected=f"{definition}()",
+            )
+        )
+    return messages
 
 
 def validate_migrations(files):
-    success = True
+    cache = load_cache()
+    signatures = {}
+    pending = []
     for file_path in files:
-        with open(file_path) as f:
-            content = f.read()
-
-        match = MIGRATION_PATTERN.search(content)
-        if match:
-            migration_class = match.group("MigrationClass")
-            if "safe = Safe." not in content:
-                success = False
-                sys.stdout.write(
-                    MISSING_SAFE_MESSAGE.format(
-                        file_path=file_path, migration_class=migration_class
-                    )
-                )
-            for definition in ENUM_DEFINITIONS:
-                if definition in content:
-                    definition = definition.replace("\n", "")
-                    corrected = f"{definition}()"
-                    success = False
-                    sys.stdout.write(
-                        UPGRADE_SAFE_DEFINITION_MESSAGE.format(
-                            file_path=file_path,
-                            migration_class=migration_class,
-                            definition=definition,
-                            corrected=corrected,
-                        )
-                    )
-    if not success:
-        sys.stdout.write(FAILURE_MESSAGE)
-    return success
+        key = os.fspath(file_path)
+        signatures[key] = signature = file_signature(file_path)
+        if cache.get(key) != signature:
+            pending.append(file_path)
+    if len(pending) < PARALLEL_THRESHOLD:
+        results = list(map(scan_migration, pending))
+    else:
+        with ProcessPoolExecutor() as executor:
+            chunksize = max(1, len(pending) // ((os.cpu_count() or 1) * 4))
+            results = list(executor.map(scan_migration, pending, chunksize=chunksize))
+    # Only cache files that passed; failures should keep being reported.
+    for file_path, result in zip(pending, results):
+        key = os.fspath(file_path)
+        if result:
+            cache.pop(key, None)
+        else:
+            cache[key] = signatures[key]
+    store_cache(cache)
+    messages = [message for result in results for message in result]
+    if messages:
+        sys.stdout.writelines(messages + [FAILURE_MESSAGE])
+    return not messages
 
 
 def main():  # pragma: no cover
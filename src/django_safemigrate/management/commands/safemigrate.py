@@ -5,15 +5,17 @@ Migration safety is enforced by a pre_migrate signal receiver.
 
 from __future__ import annotations
 
+from collections import defaultdict, deque
 from enum import Enum
+from functools import cached_property
 
 from django.conf import settings
 from django.core.management.base import CommandError
 from django.core.management.commands import migrate
+from django.db import connection
 from django.db.migrations import Migration
 from django.db.models.signals import pre_migrate
 from django.utils import timezone
-from django.utils.timesince import timeuntil
 
 from django_safemigrate import Safe, When
 from django_safemigrate.models import SafeMigration
@@ -25,22 +27,35 @@ class Mode(Enum):
     DISABLED = "disabled"
 
 
+# Shared default so migrations without a safe attribute don't each
+# allocate a fresh Safe instance.
+_DEFAULT_SAFE = Safe.always()
+
+# Hoisted so safety() doesn't rebuild the container per call. A tuple
+# rather than a frozenset: Safe instances are unhashable, and `in` on
+# a set would need to hash the candidate.
+_SAFE_CALLABLES = (Safe.before_deploy, Safe.after_deploy, Safe.always)
+
+
 def safety(migration: Migration):
     """Determine the safety status of a migration."""
-    safe = getattr(migration, "safe", Safe.always())
-    callables = [Safe.before_deploy, Safe.after_deploy, Safe.always]
-    return safe() if safe in callables else safe
+    safe = getattr(migration, "safe", _DEFAULT_SAFE)
+    return safe() if safe in _SAFE_CALLABLES else safe
+
 
+# Constant-time membership for the validity check; `in When` consults
+# the enum metaclass on every call.
+_WHEN_MEMBERS = frozenset(When)
 
-def safemigrate_mode():
-    try:
-        return Mode(getattr(settings, "SAFEMIGRATE", "strict").lower())
-    except:
-        raise ValueError("SAFEMIGRATE must be 'strict', 'nonstrict', or 'disabled'.")
+
+def invalid_safety(safe):
+    """Check whether a resolved safe value is unusable."""
+    return not isinstance(safe, Safe) or safe.when not in _WHEN_MEMBERS
 
 
 def filter_migrations(
     migrations: list[Migration],
+    safe_of: dict[Migration, Safe],
 ) -> tuple[list[Migration], list[Migration]]:
     """
     Filter migrations into ready and protected migrations.
@@ -50,25 +65,32 @@ def filter_migrations(
     """
     now = timezone.now()
 
-    detected_map = SafeMigration.objects.get_detected_map(
-        [(m.app_label, m.name) for m in migrations]
+    # Only after_deploy migrations consult the detection table, so
+    # restrict the query and the delay arithmetic to that slice.
+    after_deploy = [m for m in migrations if safe_of[m].when is When.after_deploy]
+    detected_map = (
+        SafeMigration.objects.get_detected_map(
+            [(m.app_label, m.name) for m in after_deploy]
+        )
+        if after_deploy
+        else {}
     )
 
     def is_protected(migration):
-        migration_safe = safety(migration)
+        migration_safe = safe_of[migration]
         detected = detected_map.get((migration.app_label, migration.name))
         # A migration is protected if detected is None or delay is not specified.
-        return migration_safe.when == When.after_deploy and (
+        return (
             detected is None
             or migration_safe.delay is None
             or now < (detected + migration_safe.delay)
         )
 
+    # Partition into ready and protected in a single ordered pass.
     ready = []
     protected = []
-
     for migration in migrations:
-        if is_protected(migration):
+        if safe_of[migration].when is When.after_deploy and is_protected(migration):
             protected.append(migration)
         else:
             ready.append(migration)
@@ -79,9 +101,17 @@ class Command(migrate.Command):
     """Run database migrations that are safe to run before deployment."""
 
     help = "Run database migrations that are safe to run before deployment."
-    receiver_has_run = False
     fake = False
 
+    @cached_property
+    def mode(self):
+        try:
+            return Mode(getattr(settings, "SAFEMIGRATE", "strict").lower())
+        except:
+            raise ValueError(
+                "SAFEMIGRATE must be 'strict', 'nonstrict', or 'disabled'."
+            )
+
     def handle(self, *args, **options):
         self.fake = options.get("fake", False)
         # Only connect the handler when this command is run to
@@ -93,78 +123,92 @@ class Command(migrate.Command):
 
     def pre_migrate_receiver(self, *, plan, **_):
         """Handle the pre_migrate receiver for all apps."""
-        if self.receiver_has_run:
-            # Can't just look for the run for the current app,
-            # because it only sends the signal to apps with models.
-            return  # Only run once
-        self.receiver_has_run = True
-
-        mode = safemigrate_mode()
-        if mode == Mode.DISABLED:
+        # The signal is sent once per app with models, but the plan
+        # covers them all. Disconnect on the first dispatch so later
+        # apps skip the signal machinery entirely.
+        pre_migrate.disconnect(dispatch_uid="django_safemigrate")
+
+        mode = self.mode
+        if mode is Mode.DISABLED:
             # When disabled, run migrate
             return
 
         # strict by default
-        strict = mode != Mode.NONSTRICT
-
-        if any(backward for mig, backward in plan):
-            raise CommandError("Backward migrations are not supported.")
-
-        # Pull the migrations into a new list
-        migrations = [migration for migration, backward in plan]
-
-        # Check for invalid safe properties
-        invalid = [
-            migration
-            for migration in migrations
-            if not isinstance(safety(migration), Safe)
-            or safety(migration).when not in When
-        ]
-        if invalid:
-            self.stdout.write(self.style.MIGRATE_HEADING("Invalid migrations:"))
-            for migration in invalid:
-                self.stdout.write(f"  {migration.app_label}.{migration.name}")
+        strict = mode is not Mode.NONSTRICT
+
+        # Pull the migrations into a new list and resolve the safety of
+        # each one in the same pass over the plan.
+        migrations = []
+        safe_of = {}
+        for migration, backward in plan:
+            if backward:
+                raise CommandError("Backward migrations are not supported.")
+            migrations.append(migration)
+            safe_of[migration] = safety(migration)
+
+        # Check for invalid safe properties. The common case has none,
+        # so detect with a short-circuiting scan before building the
+        # listing for display.
+        if any(invalid_safety(safe) for safe in safe_of.values()):
+            lines = [self.style.MIGRATE_HEADING("Invalid migrations:")]
+            lines.extend(
+                f"  {migration.app_label}.{migration.name}"
+                for migration, safe in safe_of.items()
+                if invalid_safety(safe)
+            )
+            self.stdout.write("\n".join(lines))
             raise CommandError(
                 "Aborting due to migrations with invalid safe properties."
             )
 
-        ready, protected = filter_migrations(migrations)
+        ready, protected = filter_migrations(migrations, safe_of)
 
         if not protected:
             self.detect(migrations)
             return  # Run all the migrations
 
         # Display the migrations that are protected
-        self.stdout.write(self.style.MIGRATE_HEADING("Protected migrations:"))
-        for migration in protected:
-            self.stdout.write(f"  {migration.app_label}.{migration.name}")
-
+        lines = [self.style.MIGRATE_HEADING("Protected migrations:")]
+        lines.extend(f"  {m.app_label}.{m.name}" for m in protected)
+        self.stdout.write("\n".join(lines))
+
+        # Build a reverse index from each migration to the migrations in
+        # the plan that must run after it, including run_before edges.
+        # Each migration's key tuple is computed once and reused.
+        key_of = {m: (m.app_label, m.name) for m in migrations}
+        by_key = {key: m for m, key in key_of.items()}
+        children = defaultdict(list)
+        for migration in migrations:
+            for dep in migration.dependencies:
+                children[dep].append(migration)
+            for target in migration.run_before:
+                child = by_key.get(target)
+                if child is not None:
+                    children[key_of[migration]].append(child)
+
+        # Propagate from the protected migrations in a single walk over
+        # the dependency graph rather than iterating to a fixed point.
+        ready_set = set(ready)
         delayed = []
         blocked = []
-
-        while True:
-            blockers = protected + delayed + blocked
-            blockers_deps = [(m.app_label, m.name) for m in blockers]
-            to_block_deps = [dep for mig in blockers for dep in mig.run_before]
-            block = [
-                migration
-                for migration in ready
-                if any(dep in blockers_deps for dep in migration.dependencies)
-                or (migration.app_label, migration.name) in to_block_deps
-            ]
-            if not block:
-                break
-
-            for migration in block:
-                ready.remove(migration)
-                if safety(migration).when == When.before_deploy:
-                    blocked.append(migration)
-                else:
-                    delayed.append(migration)
+        queue = deque(protected)
+        while queue:
+            migration = queue.popleft()
+            for child in children.get(key_of[migration], ()):
+                if child in ready_set:
+                    ready_set.discard(child)
+                    if safe_of[child].when is When.before_deploy:
+                        blocked.append(child)
+                    else:
+                        delayed.append(child)
+                    queue.append(child)
+        ready = [migration for migration in ready if migration in ready_set]
 
         # Order the migrations in the order of the original plan.
-        delayed = [m for m in migrations if m in delayed]
-        blocked = [m for m in migrations if m in blocked]
+        delayed_set = set(delayed)
+        blocked_set = set(blocked)
+        delayed = [m for m in migrations if m in delayed_set]
+        blocked = [m for m in migrations if m in blocked_set]
 
         self.delayed(delayed)
         self.blocked(blocked)
@@ -184,43 +228,67 @@ class Command(migrate.Command):
         """Detect and record migrations to the database."""
         # The detection datetime is what's used to determine if an
         # after_deploy() with a delay can be migrated or not.
-        for migration in migrations:
-            SafeMigration.objects.get_or_create(
-                app=migration.app_label, name=migration.name
+        # On a typical re-deploy most migrations are already detected,
+        # so find the existing rows with one query and only insert the
+        # missing ones.
+        keys = [(migration.app_label, migration.name) for migration in migrations]
+        existing = set(
+            SafeMigration.objects.filter(app__in={app for app, _ in keys}).values_list(
+                "app", "name"
             )
+        )
+        missing = [
+            SafeMigration(app=app, name=name)
+            for app, name in keys
+            if (app, name) not in existing
+        ]
+        if not missing:
+            return
+        # ignore_conflicts relies on the (app, name) unique constraint
+        # to leave concurrently inserted detections untouched.
+        if connection.features.supports_ignore_conflicts:
+            SafeMigration.objects.bulk_create(missing, ignore_conflicts=True)
+        else:  # pragma: no cover
+            for obj in missing:
+                SafeMigration.objects.get_or_create(app=obj.app, name=obj.name)
 
     def delayed(self, migrations):
         """Handle delayed migrations."""
         # Display delayed migrations if they exist:
         if migrations:
+            # Deferred so the translation machinery it drags in is only
+            # imported when a delayed migration is actually displayed.
+            from django.utils.timesince import timeuntil
+
             detected_map = SafeMigration.objects.get_detected_map(
                 [(m.app_label, m.name) for m in migrations]
             )
-            self.stdout.write(self.style.MIGRATE_HEADING("Delayed migrations:"))
+            now = timezone.localtime()
+            lines = [self.style.MIGRATE_HEADING("Delayed migrations:")]
             for migration in migrations:
                 migration_safe = safety(migration)
                 if (
-                    migration_safe.when == When.after_deploy
+                    migration_safe.when is When.after_deploy
                     and migration_safe.delay is not None
                 ):
-                    now = timezone.localtime()
                     detected = detected_map.get(
-                        (migration.app_label, migration.name), timezone.localtime()
+                        (migration.app_label, migration.name), now
                     )
                     migrate_date = detected + migration_safe.delay
                     humanized_date = timeuntil(migrate_date, now=now, depth=2)
-                    self.stdout.write(
+                    lines.append(
                         f"  {migration.app_label}.{migration.name} "
                         f"(can automatically migrate in {humanized_date} "
                         f"- {migrate_date.isoformat()})"
                     )
                 else:
-                    self.stdout.write(f"  {migration.app_label}.{migration.name}")
+                    lines.append(f"  {migration.app_label}.{migration.name}")
+            self.stdout.write("\n".join(lines))
 
     def blocked(self, migrations):
         """Handle blocked migrations."""
         # Display blocked migrations if they exist.
         if migrations:
-            self.stdout.write(self.style.MIGRATE_HEADING("Blocked migrations:"))
-            for migration in migrations:
-                self.stdout.write(f"  {migration.app_label}.{migration.name}")
+            lines = [self.style.MIGRATE_HEADING("Blocked migrations:")]
+            lines.extend(f"  {m.app_label}.{m.name}" for m in migrations)
+            self.stdout.write("\n".join(lines))
@@ -1,22 +1,30 @@
 from __future__ import annotations
 
+from collections import defaultdict
+
 from django.db import models
-from django.db.models.functions import Concat
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 
 class SafeMigrationManager(models.Manager):
     def get_detected_map(self, app_model_pairs: list[tuple[str, str]]):
-        detection_qs = (
-            self.get_queryset()
-            .annotate(
-                identifer=Concat(models.F("app"), models.Value("."), models.F("name"))
-            )
-            .filter(identifer__in=[".".join(pair) for pair in app_model_pairs])
-        )
+        if not app_model_pairs:
+            return {}
+        # Group the names by app so the filter can use the (app, name)
+        # unique index instead of concatenating every row.
+        names_by_app = defaultdict(list)
+        for app, name in app_model_pairs:
+            names_by_app[app].append(name)
+        condition = models.Q()
+        for app, names in names_by_app.items():
+            condition |= models.Q(app=app, name__in=names)
+        detection_qs = self.get_queryset().filter(condition)
         detected_map = {
-            (obj.app, obj.name): obj.detected for obj in detection_qs.iterator()
+            (app, name): detected
+            for app, name, detected in detection_qs.values_list(
+                "app", "name", "detected"
+            ).iterator(chunk_size=1000)
         }
         return detected_map
 
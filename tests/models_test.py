@@ -3,11 +3,20 @@ from datetime import timedelta
 import pytest
 from django.utils import timezone
 
+from django_safemigrate.management.commands.safemigrate import Command
 from django_safemigrate.models import SafeMigration
 
 pytestmark = pytest.mark.django_db
 
 
+class Migration:
+    """A mock migration."""
+
+    def __init__(self, app_label, name):
+        self.app_label = app_label
+        self.name = name
+
+
 class TestSafeMigrationManager:
     def test_get_detected_map(self):
         m1 = SafeMigration.objects.create(
@@ -23,3 +32,24 @@ class TestSafeMigrationManager:
 
         mapping = SafeMigration.objects.get_detected_map([("spam", "0001")])
         assert mapping == {("spam", "0001"): m1.detected}
+
+
+class TestCommandDetect:
+    def test_inserts_missing(self):
+        Command().detect([Migration("spam", "0001"), Migration("spam", "0002")])
+        assert SafeMigration.objects.count() == 2
+
+    def test_keeps_existing_detected(self):
+        existing = SafeMigration.objects.create(
+            app="spam", name="0001", detected=timezone.now() - timedelta(days=1)
+        )
+        Command().detect([Migration("spam", "0001"), Migration("spam", "0002")])
+        assert SafeMigration.objects.count() == 2
+        detected = SafeMigration.objects.get(app="spam", name="0001").detected
+        assert detected == existing.detected
+
+    def test_conflicting_inserts_are_ignored(self):
+        # Duplicate keys in one batch hit the same unique constraint a
+        # concurrent insert would; ignore_conflicts must absorb them.
+        Command().detect([Migration("spam", "0001"), Migration("spam", "0001")])
+        assert SafeMigration.objects.count() == 1
@@ -1,13 +1,14 @@
 """Unit tests for the safemigrate command."""
 
 from datetime import timedelta
-from io import StringIO
 
 import pytest
 from django.core.management.base import CommandError
+from django.core.management.commands import migrate
+from django.db.models.signals import pre_migrate
 from django.utils import timezone
 
-from django_safemigrate import Safe
+from django_safemigrate import Safe, check
 from django_safemigrate.check import validate_migrations
 from django_safemigrate.management.commands.safemigrate import Command
 from django_safemigrate.models import SafeMigration
@@ -16,13 +17,16 @@ from django_safemigrate.models import SafeMigration
 class Migration:
     """A mock migration."""
 
+    __slots__ = ("app_label", "name", "dependencies", "run_before", "safe")
+
     def __init__(
         self, app_label=None, name=None, dependencies=None, run_before=None, safe=None
     ):
         self.app_label = app_label or "app_label"
         self.name = name or "0001_fake_migration"
-        self.dependencies = dependencies or []
-        self.run_before = run_before or []
+        # The empty tuple is shared, unlike a fresh list per instance.
+        self.dependencies = dependencies or ()
+        self.run_before = run_before or ()
         if safe is not None:
             self.safe = safe
 
@@ -30,44 +34,164 @@ class Migration:
         return f"<Migration {self.app_label}.{self.name}>"
 
 
+def entry(app=None, name=None, safe=None, dependencies=None, run_before=None):
+    """Build a forward plan entry for the receiver."""
+    return (
+        Migration(
+            app, name, dependencies=dependencies, run_before=run_before, safe=safe
+        ),
+        False,
+    )
+
+
+class OutputSink:
+    """A minimal write target that collects command output."""
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, message):
+        self.writes.append(message)
+
+    @property
+    def text(self):
+        return "".join(self.writes)
+
+
+def seed_detected(*rows):
+    """Record (app, name, detected) rows with a single bulk insert."""
+    SafeMigration.objects.bulk_create(
+        [
+            SafeMigration(app=app, name=name, detected=detected)
+            for app, name, detected in rows
+        ]
+    )
+
+
+class FakeSafeMigrationQuerySet:
+    """A filtered view over the fake manager's rows."""
+
+    FIELDS = {"app": 0, "name": 1, "detected": 2}
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def values_list(self, *fields):
+        indexes = [self.FIELDS[field] for field in fields]
+        return [tuple(row[index] for index in indexes) for row in self.rows]
+
+    def count(self):
+        return len(self.rows)
+
+    def exists(self):
+        return bool(self.rows)
+
+
+class FakeSafeMigrationManager:
+    """An in-memory stand-in for SafeMigration.objects.
+
+    Keeps the detected datetimes in a dict keyed by (app, name) so the
+    receiver tests don't pay for database fixtures.
+    """
+
+    def __init__(self):
+        self.rows = {}
+
+    def create(self, *, app, name, detected=None):
+        obj = SafeMigration(
+            app=app,
+            name=name,
+            **({"detected": detected} if detected is not None else {}),
+        )
+        self.rows[(app, name)] = obj.detected
+        return obj
+
+    def bulk_create(self, objs, ignore_conflicts=False):
+        for obj in objs:
+            if ignore_conflicts:
+                self.rows.setdefault((obj.app, obj.name), obj.detected)
+            else:
+                self.rows[(obj.app, obj.name)] = obj.detected
+        return objs
+
+    def get_or_create(self, *, app, name):
+        if (app, name) in self.rows:
+            return SafeMigration(app=app, name=name), False
+        return self.create(app=app, name=name), True
+
+    def get_detected_map(self, app_model_pairs):
+        return {pair: self.rows[pair] for pair in app_model_pairs if pair in self.rows}
+
+    def filter(self, **kwargs):
+        matched = []
+        for (app, name), detected in self.rows.items():
+            if "app__in" in kwargs and app not in kwargs["app__in"]:
+                continue
+            if "detected__gt" in kwargs and not detected > kwargs["detected__gt"]:
+                continue
+            matched.append((app, name, detected))
+        return FakeSafeMigrationQuerySet(matched)
+
+    def count(self):
+        return len(self.rows)
+
+    def exists(self):
+        return bool(self.rows)
+
+
+@pytest.fixture(scope="session")
+def yesterday():
+    """A shared timestamp comfortably in the past."""
+    return timezone.now() - timedelta(days=1)
+
+
+@pytest.fixture(scope="class")
+def command():
+    """A single command instance shared across a test class."""
+    return Command()
+
+
 class TestSafeMigrate:
     """Unit tests for the safemigrate command."""
 
-    # Identify all tests in this class as pytest.mark.django_db
-    pytestmark = pytest.mark.django_db
+    @pytest.fixture(autouse=True)
+    def fake_safemigrations(self, mocker):
+        """Keep SafeMigration state in memory instead of the database."""
+        manager = FakeSafeMigrationManager()
+        mocker.patch.object(SafeMigration, "objects", manager)
+        return manager
 
     @pytest.fixture
-    def receiver(self):
+    def receiver(self, command):
         """A bound receiver to test against."""
-        return Command().pre_migrate_receiver
+        # The mode is cached per command, so clear it between tests to
+        # honor per-test settings overrides.
+        command.__dict__.pop("mode", None)
+        return command.pre_migrate_receiver
 
     def test_receiver_addition(self, mocker):
-        connect = mocker.patch(
-            "django_safemigrate.management.commands.safemigrate.pre_migrate.connect"
-        )
-        super_handle = mocker.patch(
-            "django_safemigrate.management.commands.safemigrate.migrate.Command.handle"
-        )
+        connect = mocker.patch.object(pre_migrate, "connect")
+        super_handle = mocker.patch.object(migrate.Command, "handle")
         command = Command()
         receiver = mocker.patch.object(command, "pre_migrate_receiver")
         command.handle()
         super_handle.assert_called_once_with()
         connect.assert_called_once_with(receiver, dispatch_uid="django_safemigrate")
 
-    def test_rerun(self, receiver):
-        """Avoid running the pre_migrate_receiver twice."""
-        receiver.__self__.receiver_has_run = True
-        plan = [(Migration(), False)]
+    def test_rerun(self, receiver, mocker):
+        """The receiver disconnects itself so it only runs once."""
+        disconnect = mocker.patch.object(pre_migrate, "disconnect")
+        plan = [entry()]
         receiver(plan=plan)
-        assert len(plan) == 1
+        disconnect.assert_called_once_with(dispatch_uid="django_safemigrate")
 
     def test_callable_compat(self, receiver):
         """Understand and do not throw an error when using compatibility syntax."""
         # The plan items aren't dependencies of each other.
         plan = [
-            (Migration(safe=Safe.before_deploy), False),
-            (Migration(safe=Safe.always), False),
-            (Migration(safe=Safe.after_deploy), False),
+            entry(safe=Safe.before_deploy),
+            entry(safe=Safe.always),
+            entry(safe=Safe.after_deploy),
         ]
         receiver(plan=plan)
         assert len(plan) == 2
@@ -80,34 +204,31 @@ class TestSafeMigrate:
 
     def test_default_always_wont_block(self, receiver):
         """Migrations are safe always by default."""
-        plan = [(Migration(safe=Safe.after_deploy()), False), (Migration(), False)]
+        plan = [entry(safe=Safe.after_deploy()), entry()]
         receiver(plan=plan)
         assert len(plan) == 1
 
     def test_default_always_wont_delay(self, receiver):
         """Migrations are safe always by default."""
-        plan = [(Migration(safe=Safe.before_deploy()), False), (Migration(), False)]
+        plan = [entry(safe=Safe.before_deploy()), entry()]
         receiver(plan=plan)
         assert len(plan) == 2
 
     def test_all_before(self, receiver):
         """Before migrations will remain in the plan."""
-        plan = [(Migration(safe=Safe.before_deploy()), False)]
+        plan = [entry(safe=Safe.before_deploy())]
         receiver(plan=plan)
         assert len(plan) == 1
 
     def test_final_after(self, receiver):
         """Run everything except the final migration."""
         plan = [
-            (Migration("spam", "0001_initial", safe=Safe.before_deploy()), False),
-            (
-                Migration(
-                    "spam",
-                    "0002_followup",
-                    safe=Safe.after_deploy(),
-                    dependencies=[("spam", "0001_initial")],
-                ),
-                False,
+            entry("spam", "0001_initial", safe=Safe.before_deploy()),
+            entry(
+                "spam",
+                "0002_followup",
+                safe=Safe.after_deploy(),
+                dependencies=[("spam", "0001_initial")],
             ),
         ]
         receiver(plan=plan)
@@ -116,164 +237,76 @@ class TestSafeMigrate:
     def test_multiple_after(self, receiver):
         """Run up to the first after migration."""
         plan = [
-            (Migration("spam", "0001_initial", safe=Safe.before_deploy()), False),
-            (
-                Migration(
-                    "spam",
-                    "0002_followup",
-                    safe=Safe.after_deploy(),
-                    dependencies=[("spam", "0001_initial")],
-                ),
-                False,
-            ),
-            (Migration("eggs", "0001_followup", safe=Safe.after_deploy()), False),
-        ]
-        receiver(plan=plan)
-        assert len(plan) == 1
-
-    def test_after_with_passed_delay(self, receiver):
-        """Run through the delayed after_deploy migration."""
-        SafeMigration.objects.create(
-            app="spam", name="0001_initial", detected=timezone.now() - timedelta(days=1)
-        )
-        SafeMigration.objects.create(
-            app="spam",
-            name="0002_followup",
-            detected=timezone.now() - timedelta(days=1),
-        )
-        plan = [
-            (
-                Migration(
-                    "spam",
-                    "0001_initial",
-                    safe=Safe.after_deploy(delay=timedelta(hours=12)),
-                ),
-                False,
-            ),
-            (
-                Migration(
-                    "spam",
-                    "0002_followup",
-                    safe=Safe.after_deploy(delay=timedelta(days=2)),
-                    dependencies=[("spam", "0001_initial")],
-                ),
-                False,
+            entry("spam", "0001_initial", safe=Safe.before_deploy()),
+            entry(
+                "spam",
+                "0002_followup",
+                safe=Safe.after_deploy(),
+                dependencies=[("spam", "0001_initial")],
             ),
+            entry("eggs", "0001_followup", safe=Safe.after_deploy()),
         ]
         receiver(plan=plan)
         assert len(plan) == 1
-        assert plan[0][0].name == "0001_initial"
-
-    def test_after_blocks_passed_delay(self, receiver):
-        """
-        An after_deploy migration without a delay blocks a after_deploy
-        migration with a passed delay.
-        """
-        SafeMigration.objects.create(
-            app="spam", name="0001_initial", detected=timezone.now() - timedelta(days=1)
-        )
-        SafeMigration.objects.create(
-            app="spam",
-            name="0002_followup",
-            detected=timezone.now() - timedelta(days=1),
-        )
-        plan = [
-            (
-                Migration(
-                    "spam",
-                    "0001_initial",
-                    safe=Safe.after_deploy(delay=timedelta(days=2)),
-                ),
-                False,
-            ),
-            (
-                Migration(
-                    "spam",
-                    "0002_followup",
-                    safe=Safe.after_deploy(delay=timedelta(hours=12)),
-                    dependencies=[("spam", "0001_initial")],
-                ),
-                False,
-            ),
-        ]
-        receiver(plan=plan)
-        assert len(plan) == 0
-
-    def test_after_with_no_detected_blocks_passed_delay(self, receiver):
-        """
-        An after_deploy migration without a detected blocks a after_deploy
-        migration with a passed delay.
-        """
-        SafeMigration.objects.create(
-            app="spam",
-            name="0002_followup",
-            detected=timezone.now() - timedelta(days=1),
-        )
-        plan = [
-            (
-                Migration(
-                    "spam",
-                    "0001_initial",
-                    safe=Safe.after_deploy(delay=timedelta(days=2)),
-                ),
-                False,
-            ),
-            (
-                Migration(
-                    "spam",
-                    "0002_followup",
-                    safe=Safe.after_deploy(delay=timedelta(hours=12)),
-                    dependencies=[("spam", "0001_initial")],
-                ),
-                False,
-            ),
-        ]
-        receiver(plan=plan)
-        assert len(plan) == 0
 
-    def test_after_with_no_delay_blocks_passed_delay(self, receiver):
-        """
-        An after_deploy migration without a delay blocks a after_deploy
-        migration with a passed delay.
+    @pytest.mark.parametrize(
+        ("seeded", "delays", "expected"),
+        [
+            pytest.param(
+                ("0001_initial", "0002_followup"),
+                (timedelta(hours=12), timedelta(days=2)),
+                ["0001_initial"],
+                id="passed-delay-migrates",
+            ),
+            pytest.param(
+                ("0001_initial", "0002_followup"),
+                (timedelta(days=2), timedelta(hours=12)),
+                [],
+                id="unpassed-delay-blocks-passed-delay",
+            ),
+            pytest.param(
+                ("0002_followup",),
+                (timedelta(days=2), timedelta(hours=12)),
+                [],
+                id="undetected-blocks-passed-delay",
+            ),
+            pytest.param(
+                ("0001_initial", "0002_followup"),
+                (None, timedelta(hours=12)),
+                [],
+                id="no-delay-blocks-passed-delay",
+            ),
+            pytest.param(
+                (),
+                (timedelta(hours=-1),),
+                [],
+                id="first-run-never-migrates",
+            ),
+        ],
+    )
+    def test_after_delay_scenarios(self, receiver, yesterday, seeded, delays, expected):
+        """Check how after_deploy delays interact along a dependency chain.
+
+        A passed delay migrates. An unpassed, missing, or undetected
+        delay protects the migration and everything that must run
+        after it, and a delay can't pass on the same run that first
+        detects the migration.
         """
-        SafeMigration.objects.create(
-            app="spam", name="0001_initial", detected=timezone.now() - timedelta(days=1)
-        )
-        SafeMigration.objects.create(
-            app="spam",
-            name="0002_followup",
-            detected=timezone.now() - timedelta(days=1),
-        )
-        plan = [
-            (Migration("spam", "0001_initial", safe=Safe.after_deploy()), False),
-            (
-                Migration(
-                    "spam",
-                    "0002_followup",
-                    safe=Safe.after_deploy(delay=timedelta(hours=12)),
-                    dependencies=[("spam", "0001_initial")],
-                ),
-                False,
-            ),
-        ]
-        receiver(plan=plan)
-        assert len(plan) == 0
-
-    def test_after_doesnt_apply_on_first_run(self, receiver):
-        """An after_deploy migration with a passed delay only can't run
-        on the same command it was detected."""
-        plan = [
-            (
-                Migration(
+        seed_detected(*(("spam", name, yesterday) for name in seeded))
+        plan = []
+        previous = None
+        for name, delay in zip(("0001_initial", "0002_followup"), delays):
+            plan.append(
+                entry(
                     "spam",
-                    "0001_initial",
-                    safe=Safe.after_deploy(delay=timedelta(hours=-1)),
-                ),
-                False,
-            ),
-        ]
+                    name,
+                    safe=Safe.after_deploy(delay=delay),
+                    dependencies=[("spam", previous)] if previous else None,
+                )
+            )
+            previous = name
         receiver(plan=plan)
-        assert len(plan) == 0
+        assert [migration.name for migration, _ in plan] == expected
 
     def test_after_message(self):
         """
@@ -293,9 +326,9 @@ class TestSafeMigrate:
                 dependencies=[("spam", "0001_initial")],
             ),
         ]
-        out = StringIO()
+        out = OutputSink()
         Command(stdout=out).delayed(migrations)
-        result = out.getvalue().strip()
+        result = out.text.strip()
         header, migration1, migration2 = result.split("\n", maxsplit=2)
         assert header == "Delayed migrations:"
         assert migration1.startswith(
@@ -303,13 +336,13 @@ class TestSafeMigrate:
         )
         assert migration2 == "  spam.0002_followup"
 
-    def test_after_message_preseen(self):
+    def test_after_message_preseen(self, yesterday):
         """
         Confirm the delayed messaging of a pre-existing migration with
         an after_deploy safety.
         """
         SafeMigration.objects.create(
-            app="spam", name="0001_initial", detected=timezone.now() - timedelta(days=1)
+            app="spam", name="0001_initial", detected=yesterday
         )
         migrations = [
             Migration(
@@ -325,9 +358,9 @@ class TestSafeMigrate:
                 dependencies=[("spam", "0001_initial")],
             ),
         ]
-        out = StringIO()
+        out = OutputSink()
         Command(stdout=out).delayed(migrations)
-        result = out.getvalue().strip()
+        result = out.text.strip()
         header, migration1, migration2 = result.split("\n", maxsplit=2)
         assert header == "Delayed migrations:"
         assert migration1.startswith(
@@ -344,24 +377,18 @@ class TestSafeMigrate:
         block to avoid release failures.
         """
         plan = [
-            (Migration("spam", "0001_initial", safe=Safe.before_deploy()), False),
-            (
-                Migration(
-                    "spam",
-                    "0002_followup",
-                    safe=Safe.after_deploy(),
-                    dependencies=[("spam", "0001_initial")],
-                ),
-                False,
-            ),
-            (
-                Migration(
-                    "spam",
-                    "0003_safety",
-                    safe=Safe.before_deploy(),
-                    dependencies=[("spam", "0002_followup")],
-                ),
-                False,
+            entry("spam", "0001_initial", safe=Safe.before_deploy()),
+            entry(
+                "spam",
+                "0002_followup",
+                safe=Safe.after_deploy(),
+                dependencies=[("spam", "0001_initial")],
+            ),
+            entry(
+                "spam",
+                "0003_safety",
+                safe=Safe.before_deploy(),
+                dependencies=[("spam", "0002_followup")],
             ),
         ]
         with pytest.raises(CommandError):
@@ -375,18 +402,15 @@ class TestSafeMigrate:
         your control to add a dependency to directly.
         """
         plan = [
-            (Migration("spam", "0001_initial", safe=Safe.before_deploy()), False),
-            (
-                Migration(
-                    "spam",
-                    "0002_followup",
-                    safe=Safe.after_deploy(),
-                    dependencies=[("spam", "0001_initial")],
-                    run_before=[("eggs", "0001_safety")],
-                ),
-                False,
-            ),
-            (Migration("eggs", "0001_safety", safe=Safe.before_deploy()), False),
+            entry("spam", "0001_initial", safe=Safe.before_deploy()),
+            entry(
+                "spam",
+                "0002_followup",
+                safe=Safe.after_deploy(),
+                dependencies=[("spam", "0001_initial")],
+                run_before=[("eggs", "0001_safety")],
+            ),
+            entry("eggs", "0001_safety", safe=Safe.before_deploy()),
         ]
         with pytest.raises(CommandError):
             receiver(plan=plan)
@@ -394,24 +418,18 @@ class TestSafeMigrate:
     def test_consecutive_after(self, receiver):
         """Consecutive after migrations are ok."""
         plan = [
-            (Migration("spam", "0001_initial", safe=Safe.before_deploy()), False),
-            (
-                Migration(
-                    "spam",
-                    "0002_followup",
-                    safe=Safe.after_deploy(),
-                    dependencies=[("spam", "0001_initial")],
-                ),
-                False,
-            ),
-            (
-                Migration(
-                    "spam",
-                    "0003_safety",
-                    safe=Safe.after_deploy(),
-                    dependencies=[("spam", "0002_followup")],
-                ),
-                False,
+            entry("spam", "0001_initial", safe=Safe.before_deploy()),
+            entry(
+                "spam",
+                "0002_followup",
+                safe=Safe.after_deploy(),
+                dependencies=[("spam", "0001_initial")],
+            ),
+            entry(
+                "spam",
+                "0003_safety",
+                safe=Safe.after_deploy(),
+                dependencies=[("spam", "0002_followup")],
             ),
         ]
         receiver(plan=plan)
@@ -420,15 +438,12 @@ class TestSafeMigrate:
     def test_always_before_after(self, receiver):
         """Always migrations will run before after migrations."""
         plan = [
-            (Migration("spam", "0001_initial", safe=Safe.always()), False),
-            (
-                Migration(
-                    "spam",
-                    "0002_followup",
-                    safe=Safe.after_deploy(),
-                    dependencies=[("spam", "0001_initial")],
-                ),
-                False,
+            entry("spam", "0001_initial", safe=Safe.always()),
+            entry(
+                "spam",
+                "0002_followup",
+                safe=Safe.after_deploy(),
+                dependencies=[("spam", "0001_initial")],
             ),
         ]
         receiver(plan=plan)
@@ -437,15 +452,12 @@ class TestSafeMigrate:
     def test_always_after_after(self, receiver):
         """Always migrations will not block after deployments."""
         plan = [
-            (Migration("spam", "0001_initial", safe=Safe.after_deploy()), False),
-            (
-                Migration(
-                    "spam",
-                    "0002_followup",
-                    safe=Safe.always(),
-                    dependencies=[("spam", "0001_initial")],
-                ),
-                False,
+            entry("spam", "0001_initial", safe=Safe.after_deploy()),
+            entry(
+                "spam",
+                "0002_followup",
+                safe=Safe.always(),
+                dependencies=[("spam", "0001_initial")],
             ),
         ]
         receiver(plan=plan)
@@ -462,24 +474,18 @@ class TestSafeMigrate:
         """
         settings.SAFEMIGRATE = "nonstrict"
         plan = [
-            (Migration("spam", "0001_initial", safe=Safe.before_deploy()), False),
-            (
-                Migration(
-                    "spam",
-                    "0002_followup",
-                    safe=Safe.after_deploy(),
-                    dependencies=[("spam", "0001_initial")],
-                ),
-                False,
-            ),
-            (
-                Migration(
-                    "spam",
-                    "0003_safety",
-                    safe=Safe.before_deploy(),
-                    dependencies=[("spam", "0002_followup")],
-                ),
-                False,
+            entry("spam", "0001_initial", safe=Safe.before_deploy()),
+            entry(
+                "spam",
+                "0002_followup",
+                safe=Safe.after_deploy(),
+                dependencies=[("spam", "0001_initial")],
+            ),
+            entry(
+                "spam",
+                "0003_safety",
+                safe=Safe.before_deploy(),
+                dependencies=[("spam", "0002_followup")],
             ),
         ]
         receiver(plan=plan)
@@ -489,22 +495,16 @@ class TestSafeMigrate:
         """Nonstrict mode runs even with blocked migrations."""
         settings.SAFEMIGRATE = "nonstrict"
         plan = [
-            (
-                Migration(
-                    "auth",
-                    "0001_initial",
-                    safe=Safe.after_deploy(),
-                ),
-                False,
-            ),
-            (
-                Migration(
-                    "spam",
-                    "0001_initial",
-                    safe=Safe.before_deploy(),
-                    dependencies=[("auth", "0001_initial")],
-                ),
-                False,
+            entry(
+                "auth",
+                "0001_initial",
+                safe=Safe.after_deploy(),
+            ),
+            entry(
+                "spam",
+                "0001_initial",
+                safe=Safe.before_deploy(),
+                dependencies=[("auth", "0001_initial")],
             ),
         ]
         receiver(plan=plan)
@@ -514,39 +514,27 @@ class TestSafeMigrate:
         """Disabled mode allows all migrations"""
         settings.SAFEMIGRATE = "disabled"
         plan = [
-            (
-                Migration(
-                    "auth",
-                    "0001_initial",
-                ),
-                False,
-            ),
-            (
-                Migration(
-                    "spam",
-                    "0001_initial",
-                    safe=Safe.before_deploy(),
-                    dependencies=[("auth", "0001_initial")],
-                ),
-                False,
-            ),
-            (
-                Migration(
-                    "spam",
-                    "0002_followup",
-                    safe=Safe.after_deploy(),
-                    dependencies=[("spam", "0001_initial")],
-                ),
-                False,
-            ),
-            (
-                Migration(
-                    "spam",
-                    "0003_safety",
-                    safe=Safe.before_deploy(),
-                    dependencies=[("spam", "0002_followup")],
-                ),
-                False,
+            entry(
+                "auth",
+                "0001_initial",
+            ),
+            entry(
+                "spam",
+                "0001_initial",
+                safe=Safe.before_deploy(),
+                dependencies=[("auth", "0001_initial")],
+            ),
+            entry(
+                "spam",
+                "0002_followup",
+                safe=Safe.after_deploy(),
+                dependencies=[("spam", "0001_initial")],
+            ),
+            entry(
+                "spam",
+                "0003_safety",
+                safe=Safe.before_deploy(),
+                dependencies=[("spam", "0002_followup")],
             ),
         ]
         receiver(plan=plan)
@@ -561,37 +549,31 @@ class TestSafeMigrate:
 
     def test_string_invalid(self, receiver):
         """Invalid settings of the safe property will raise an error."""
-        plan = [(Migration("spam", "0001_initial", safe="before_deploy"), False)]
+        plan = [entry("spam", "0001_initial", safe="before_deploy")]
         with pytest.raises(CommandError):
             receiver(plan=plan)
 
     def test_boolean_invalid(self, receiver):
         """Booleans are invalid for the safe property."""
-        plan = [(Migration("spam", "0001_initial", safe=False), False)]
+        plan = [entry("spam", "0001_initial", safe=False)]
         with pytest.raises(CommandError):
             receiver(plan=plan)
 
     def test_migrations_not_detected_when_blocked(self, receiver):
         """If the plan can't advance, the migrations shouldn't be marked as detected."""
         plan = [
-            (Migration("spam", "0001_initial", safe=Safe.before_deploy()), False),
-            (
-                Migration(
-                    "spam",
-                    "0002_followup",
-                    safe=Safe.after_deploy(),
-                    dependencies=[("spam", "0001_initial")],
-                ),
-                False,
-            ),
-            (
-                Migration(
-                    "spam",
-                    "0003_safety",
-                    safe=Safe.before_deploy(),
-                    dependencies=[("spam", "0002_followup")],
-                ),
-                False,
+            entry("spam", "0001_initial", safe=Safe.before_deploy()),
+            entry(
+                "spam",
+                "0002_followup",
+                safe=Safe.after_deploy(),
+                dependencies=[("spam", "0001_initial")],
+            ),
+            entry(
+                "spam",
+                "0003_safety",
+                safe=Safe.before_deploy(),
+                dependencies=[("spam", "0002_followup")],
             ),
         ]
         with pytest.raises(CommandError):
@@ -601,24 +583,18 @@ class TestSafeMigrate:
     def test_migrations_not_detected_when_faked(self, receiver):
         """If migrate command is faked, the migrations shouldn't be marked as detected."""
         plan = [
-            (Migration("spam", "0001_initial", safe=Safe.before_deploy()), False),
-            (
-                Migration(
-                    "spam",
-                    "0002_followup",
-                    safe=Safe.after_deploy(),
-                    dependencies=[("spam", "0001_initial")],
-                ),
-                False,
-            ),
-            (
-                Migration(
-                    "spam",
-                    "0003_safety",
-                    safe=Safe.after_deploy(),
-                    dependencies=[("spam", "0002_followup")],
-                ),
-                False,
+            entry("spam", "0001_initial", safe=Safe.before_deploy()),
+            entry(
+                "spam",
+                "0002_followup",
+                safe=Safe.after_deploy(),
+                dependencies=[("spam", "0001_initial")],
+            ),
+            entry(
+                "spam",
+                "0003_safety",
+                safe=Safe.after_deploy(),
+                dependencies=[("spam", "0002_followup")],
             ),
         ]
         command = Command()
@@ -626,30 +602,24 @@ class TestSafeMigrate:
         command.pre_migrate_receiver(plan=plan)
         assert SafeMigration.objects.count() == 0
 
-    def test_migrations_are_detected(self, receiver):
+    def test_migrations_are_detected(self, receiver, yesterday):
         """Migrations should be marked as detected during the happy flow."""
         existing = SafeMigration.objects.create(
-            app="spam", name="0001_initial", detected=timezone.now() - timedelta(days=1)
+            app="spam", name="0001_initial", detected=yesterday
         )
         plan = [
-            (Migration("spam", "0001_initial", safe=Safe.before_deploy()), False),
-            (
-                Migration(
-                    "spam",
-                    "0002_followup",
-                    safe=Safe.after_deploy(),
-                    dependencies=[("spam", "0001_initial")],
-                ),
-                False,
-            ),
-            (
-                Migration(
-                    "spam",
-                    "0003_safety",
-                    safe=Safe.after_deploy(),
-                    dependencies=[("spam", "0002_followup")],
-                ),
-                False,
+            entry("spam", "0001_initial", safe=Safe.before_deploy()),
+            entry(
+                "spam",
+                "0002_followup",
+                safe=Safe.after_deploy(),
+                dependencies=[("spam", "0001_initial")],
+            ),
+            entry(
+                "spam",
+                "0003_safety",
+                safe=Safe.after_deploy(),
+                dependencies=[("spam", "0002_followup")],
             ),
         ]
         receiver(plan=plan)
@@ -660,28 +630,19 @@ class TestSafeMigrate:
     def test_migrations_are_detected_when_no_delays(self, receiver):
         """Migrations should be marked as detected when there are no delays."""
         plan = [
-            (Migration("spam", "0001_initial", safe=Safe.before_deploy()), False),
-            (
-                Migration(
-                    "spam",
-                    "0002_followup",
-                    safe=Safe.always(),
-                    dependencies=[("spam", "0001_initial")],
-                ),
-                False,
+            entry("spam", "0001_initial", safe=Safe.before_deploy()),
+            entry(
+                "spam",
+                "0002_followup",
+                safe=Safe.always(),
+                dependencies=[("spam", "0001_initial")],
             ),
         ]
         receiver(plan=plan)
         assert SafeMigration.objects.count() == 2
 
 
-class TestCheckMissingSafe:
-    """
-    Test the check command for migrations
-    missing the safe attribute
-    """
-
-    MARKED = """
+MARKED = """
 from django.db import migrations
 from django_safemigrate import Safe
 
@@ -689,44 +650,121 @@ class Migration(migrations.Migration):
     safe = Safe.always()
 """
 
-    UNMARKED = """
+UNMARKED = """
 from django.db import migrations
 
 class Migration(migrations.Migration):
     pass
 """
 
-    def test_validate_migrations_success(self, tmp_path):
-        with open(tmp_path / "0001_initial.py", "w") as f:
-            f.write(self.MARKED)
-        assert validate_migrations([tmp_path / "0001_initial.py"])
+ENUM_DEFINITION = """
+from django.db import migrations
+from django_safemigrate import Safe
+
+class Migration(migrations.Migration):
+    safe = Safe.always
+"""
+
+
+@pytest.fixture
+def isolated_cache(tmp_path, monkeypatch):
+    """Keep the check pass cache out of the working tree."""
+    monkeypatch.setattr(check, "CACHE_PATH", str(tmp_path / "safemigrate-cache"))
 
-    def test_validate_migrations_failure(self, tmp_path):
-        with open(tmp_path / "0001_initial.py", "w") as f:
-            f.write(self.UNMARKED)
-        assert not validate_migrations([tmp_path / "0001_initial.py"])
 
-    def test_validate_migrations_falsematch(self, tmp_path):
-        with open(tmp_path / "0001_initial.py", "w") as f:
-            f.write("THIS IS NOT A MIGRATION")
-        assert validate_migrations([tmp_path / "0001_initial.py"])
+@pytest.fixture(scope="session")
+def migration_file(tmp_path_factory):
+    """Write each migration source to disk once per session."""
+    root = tmp_path_factory.mktemp("migrations")
+    paths = {}
 
+    def write(name, source):
+        if name not in paths:
+            path = root / f"{name}.py"
+            path.write_text(source)
+            paths[name] = path
+        return paths[name]
 
+    return write
+
+
+@pytest.mark.usefixtures("isolated_cache")
+class TestCheckMissingSafe:
+    """
+    Test the check command for migrations
+    missing the safe attribute
+    """
+
+    def test_validate_migrations_success(self, migration_file):
+        assert validate_migrations([migration_file("marked", MARKED)])
+
+    def test_validate_migrations_failure(self, migration_file):
+        assert not validate_migrations([migration_file("unmarked", UNMARKED)])
+
+    def test_validate_migrations_falsematch(self, migration_file):
+        assert validate_migrations(
+            [migration_file("falsematch", "THIS IS NOT A MIGRATION")]
+        )
+
+
+@pytest.mark.usefixtures("isolated_cache")
+class TestCheckCache:
+    """Test the pass cache that lets the check skip unchanged files."""
+
+    def test_unchanged_passing_file_skipped(self, tmp_path, mocker):
+        path = tmp_path / "marked.py"
+        path.write_text(MARKED)
+        assert validate_migrations([path])
+        scan = mocker.spy(check, "scan_migration")
+        assert validate_migrations([path])
+        scan.assert_not_called()
+
+    def test_changed_file_rescanned(self, tmp_path):
+        path = tmp_path / "migration.py"
+        path.write_text(MARKED)
+        assert validate_migrations([path])
+        path.write_text(UNMARKED)
+        assert not validate_migrations([path])
+
+    def test_failing_file_not_cached(self, tmp_path, mocker):
+        path = tmp_path / "unmarked.py"
+        path.write_text(UNMARKED)
+        assert not validate_migrations([path])
+        scan = mocker.spy(check, "scan_migration")
+        assert not validate_migrations([path])
+        scan.assert_called_once()
+
+    def test_garbage_cache_tolerated(self, tmp_path):
+        (tmp_path / "safemigrate-cache").write_text("not json")
+        path = tmp_path / "marked.py"
+        path.write_text(MARKED)
+        assert validate_migrations([path])
+
+
+@pytest.mark.usefixtures("isolated_cache")
 class TestCheckEnumAttribute:
     """
     Test the check command for migrations
     missing the safe attribute
     """
 
-    ENUM_DEFINITION = """
-from django.db import migrations
-from django_safemigrate import Safe
+    def test_validate_migrations_failure(self, migration_file):
+        assert not validate_migrations(
+            [migration_file("enum_definition", ENUM_DEFINITION)]
+        )
 
-class Migration(migrations.Migration):
-    safe = Safe.always
-"""
+    def test_validate_migrations_failure_crlf(self, migration_file):
+        """Deprecated definitions are still caught in CRLF checkouts."""
+        assert not validate_migrations(
+            [
+                migration_file(
+                    "enum_definition_crlf", ENUM_DEFINITION.replace("\n", "\r\n")
+                )
+            ]
+        )
 
-    def test_validate_migrations_failure(self, tmp_path):
-        with open(tmp_path / "0001_initial.py", "w") as f:
-            f.write(self.ENUM_DEFINITION)
-        assert not validate_migrations([tmp_path / "0001_initial.py"])
+    def test_repeated_definition_reported_once(self, migration_file):
+        path = migration_file(
+            "enum_definition_repeated", ENUM_DEFINITION + "    safe = Safe.always\n"
+        )
+        assert len(check.scan_migration(path)) == 1